@@ -10,7 +10,9 @@
 #     "markdown",
 #     "beautifulsoup4",
 #     "PyMuPDF",
-#     "ollama>=0.1.6"
+#     "ollama>=0.1.6",
+#     "blake3",
+#     "orjson"
 # ]
 # ///
 
@@ -39,8 +41,11 @@ For documentation, it generates:
 All outputs are saved in a timestamped folder and stored in a SQLite database.
 """
 
-import os, sys, sqlite3, hashlib, requests, re, asyncio, aiohttp, json, argparse
+import os, sys, sqlite3, hashlib, requests, re, asyncio, aiohttp, json, argparse, threading, itertools, atexit, functools
+import contextvars
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from concurrent.futures import ThreadPoolExecutor
 from diskcache import Cache
 from rich import print
@@ -53,7 +58,8 @@ from rich.markdown import Markdown
 from rich.syntax import Syntax
 from typing import Optional, Dict, Any, List, Tuple
 from urllib.parse import urlparse
-import tempfile
+from pathlib import Path
+import tempfile, shutil, glob
 import random, time
 import ollama  # Import the ollama-python client
 
@@ -71,6 +77,18 @@ except ImportError:
     except ImportError:
         fitz = None
 
+# BLAKE3 hashes large inputs several times faster than SHA-256; fall back to hashlib without it
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
+
+# orjson encodes/decodes large LLM payloads much faster than the stdlib json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 console = Console()
 
 # -------------------------------
@@ -78,6 +96,12 @@ console = Console()
 # -------------------------------
 # Ollama settings
 OLLAMA_API_URL = "http://localhost:11434/api/generate"  # Updated to match test_ollama.py
+# Comma-separated Ollama servers; requests are spread round-robin across them. Each server
+# only generates in parallel if started with spare slots, e.g. `OLLAMA_NUM_PARALLEL=4 ollama serve`
+# Unset or empty means a single client on the library default, which honours OLLAMA_HOST.
+OLLAMA_HOSTS = [host.strip() for host in os.environ.get("DC_OLLAMA_HOSTS", "").split(",") if host.strip()] or [None]
+ollama_clients = [ollama.Client(host=host) for host in OLLAMA_HOSTS]
+ollama_client_cycle = itertools.cycle(ollama_clients)
 
 # OpenRouter settings
 OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
@@ -88,6 +112,19 @@ OPENROUTER_API_KEY = ""  # Will be prompted for this
 
 # General LLM settings
 MAX_TOKENS = 10000
+# Generation caps per phase: reports need room, diagrams are short. Decode time grows
+# with generated tokens, so capping the diagram phases bounds their latency. Reports are
+# left to the provider default (20000 on OpenRouter, uncapped on Ollama). Reasoning models
+# spend part of the cap on their <think> block, so a diagram reply cut off before any
+# Mermaid code is neither cached nor reused, and is retried once without the cap
+REPORT_MAX_TOKENS = None
+DIAGRAM_MAX_TOKENS = 2048
+MAX_PROMPT_LENGTH = 12000  # Characters; longer prompts are truncated before sending
+try:
+    LLM_CONCURRENCY = int(os.environ.get("DC_CONCURRENCY", 4))  # Contracts analysed at once
+except ValueError:
+    LLM_CONCURRENCY = 4
+LLM_CONCURRENCY = max(1, LLM_CONCURRENCY)  # Semaphore(0) would never let a task start
 MODEL_NAME = "deepseek-r1:32b"  # Default for Ollama
 ANALYSIS_MODEL = None
 QUERY_MODEL = None
@@ -107,22 +144,118 @@ OPENROUTER_MODELS = [
     "featherless/qwerky-72b:free"
 ]
 
+# Let the async analysis path answer with another of OPENROUTER_MODELS when the chosen
+# model keeps failing; off by default so reports always come from the model you picked
+OPENROUTER_FALLBACK = os.environ.get("DC_OPENROUTER_FALLBACK", "").lower() in ("1", "true", "yes")
+
 # Cache configuration
 cache = Cache('.cache')
 MAX_CACHE_SIZE = 1024 * 1024 * 1024  # 1GB cache size
 CACHE_EXPIRY = 60 * 60 * 24  # 24 hours
+USE_LLM_CACHE = True  # Disabled with --no-cache to force fresh LLM responses
+# Reuse stored analyses of identical contract source; disabled with --force or DC_FORCE=1
+REUSE_ANALYSES = os.environ.get("DC_FORCE", "").lower() not in ("1", "true", "yes")
+
+# Name of the algorithm behind new_hasher(), recorded alongside stored content digests
+HASH_ALGORITHM = "blake3" if blake3 is not None else "sha256"
+
+def new_hasher():
+    """Return a fresh BLAKE3 hasher when installed, SHA-256 otherwise"""
+    return blake3() if blake3 is not None else hashlib.sha256()
+
+def fast_hash(*parts):
+    """Hex digest of NUL-separated strings, using BLAKE3 when installed and SHA-256 otherwise"""
+    hasher = new_hasher()
+    # Feed each part separately rather than hashing one concatenated copy of a large prompt
+    for i, part in enumerate(parts):
+        if i:
+            hasher.update(b"\x00")
+        hasher.update(part.encode("utf-8"))
+    return hasher.hexdigest()
+
+def json_dumps_bytes(obj):
+    """Serialise an API request body to UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+def json_loads(data):
+    """Parse a JSON API response body (str or bytes)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def llm_cache_key(prompt, model, provider):
+    """Build the cache key for an LLM response to a given prompt"""
+    return fast_hash(provider, str(model), prompt)
+
+def get_cached_response(cache_key):
+    """Look up a cached LLM response, unless caching was disabled"""
+    if not USE_LLM_CACHE:
+        return None
+    return cache.get(cache_key)
+
+# Shared HTTP session so synchronous requests reuse pooled keep-alive connections
+http_session = requests.Session()
+# Transient gateway errors are retried at the transport level for idempotent requests (model
+# listing etc.); LLM POSTs keep their own retry loops so a generation isn't repeated twice over
+http_retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+http_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=http_retry)
+http_session.mount("http://", http_adapter)
+http_session.mount("https://", http_adapter)
+atexit.register(http_session.close)
 
 # Async session
 async_session = None
+async_ollama_clients = None
+async_ollama_client_cycle = None
 
 # -------------------------------
 # SQLite Database Setup
 # -------------------------------
 DB_NAME = "smart_contracts_analysis.db"
 
+# One long-lived connection in WAL mode, shared by the analysis pipeline
+db_conn = None
+db_lock = threading.Lock()
+
+def get_db():
+    """Return the shared SQLite connection, opening it on first use"""
+    global db_conn
+    if db_conn is None:
+        # Autocommit mode: each write commits on its own, batches use explicit transactions
+        db_conn = sqlite3.connect(DB_NAME, check_same_thread=False, isolation_level=None)
+        # Rows support access by column name as well as by index
+        db_conn.row_factory = sqlite3.Row
+        db_conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA mmap_size=268435456;
+        """)
+    return db_conn
+
+def close_db():
+    global db_conn
+    if db_conn is not None:
+        db_conn.close()
+        db_conn = None
+
+# Bumped whenever init_db/update_db_schema change; stored in PRAGMA user_version
+SCHEMA_VERSION = 3
+
 def init_db():
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_db()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
     cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    if version >= SCHEMA_VERSION:
+        # Schema is already current, skip all DDL and introspection. Digests still need
+        # checking: they follow HASH_ALGORITHM, which changes if blake3 is (un)installed
+        rehash_stale_digests(cur)
+        cur.execute("COMMIT")
+        return
+    
     # Original contracts table
     cur.execute("""
        CREATE TABLE IF NOT EXISTS contracts (
@@ -133,7 +266,9 @@ def init_db():
            journey_report TEXT,
            journey_diagram TEXT,
            call_diagram TEXT,
-           analysed_at TEXT
+           analysed_at TEXT,
+           content_sha TEXT,
+           model TEXT
        )
     """)
     
@@ -174,244 +309,320 @@ def init_db():
         )
     """)
     
-    conn.commit()
-    conn.close()
+    update_db_schema(cur, version)
+    cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    cur.execute("COMMIT")
 
-def update_db_schema():
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    
-    # Update contracts table if needed
+def update_db_schema(cur, version):
+    """Migrate tables created by older versions of the app to the current schema"""
     cur.execute("PRAGMA table_info(contracts)")
-    columns = [col[1] for col in cur.fetchall()]
-    needed = ["functions_report", "journey_report", "journey_diagram", "call_diagram"]
-    for col in needed:
-        if col not in columns:
-            cur.execute(f"ALTER TABLE contracts ADD COLUMN {col} TEXT")
-            console.print(f"[bold green]Database schema updated:[/bold green] '{col}' column added to contracts table.")
-    
-    # Check if documents table exists, create if not
-    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='documents'")
-    if not cur.fetchone():
-        cur.execute("""
-            CREATE TABLE documents (
-                id TEXT PRIMARY KEY,
-                source_type TEXT,
-                source_path TEXT,
-                content TEXT,
-                summary TEXT,
-                key_highlights TEXT,
-                contract_breakdown TEXT,
-                function_breakdown TEXT,
-                mechanics_diagram TEXT,
-                analysed_at TEXT
-            )
-        """)
-        console.print("[bold green]Database schema updated:[/bold green] 'documents' table created.")
+    columns = [col["name"] for col in cur.fetchall()]
     
-    conn.commit()
-    conn.close()
+    if version < 1:
+        # Update contracts table if needed
+        needed = ["functions_report", "journey_report", "journey_diagram", "call_diagram"]
+        for col in needed:
+            if col not in columns:
+                cur.execute(f"ALTER TABLE contracts ADD COLUMN {col} TEXT")
+                console.print(f"[bold green]Database schema updated:[/bold green] '{col}' column added to contracts table.")
+    
+    if version < 2:
+        # Content hash and model let identical contracts reuse an earlier analysis
+        for col in ["content_sha", "model"]:
+            if col not in columns:
+                cur.execute(f"ALTER TABLE contracts ADD COLUMN {col} TEXT")
+    
+    # Content digests became "<algorithm>:<hex>" in version 3; rehash stored sources in the current format
+    rehash_stale_digests(cur)
+    
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_contracts_content_sha ON contracts (content_sha)")
 
-def save_analysis(contract_id, filename, content, functions_report, journey_report, journey_diagram, call_diagram):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
+def rehash_stale_digests(cur):
+    """Recompute content digests not made with the current HASH_ALGORITHM, so reuse keeps matching"""
     cur.execute("""
-       INSERT OR REPLACE INTO contracts
-       (id, filename, content, functions_report, journey_report, journey_diagram, call_diagram, analysed_at)
-       VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, (contract_id, filename, content, functions_report, journey_report, journey_diagram, call_diagram, datetime.now().isoformat()))
-    conn.commit()
-    conn.close()
+        SELECT id, content FROM contracts
+        WHERE content IS NOT NULL AND (content_sha IS NULL OR content_sha NOT LIKE ?)
+    """, (f"{HASH_ALGORITHM}:%",))
+    rehashed = [(content_digest(row["content"]), row["id"]) for row in cur.fetchall()]
+    if rehashed:
+        cur.executemany("UPDATE contracts SET content_sha = ? WHERE id = ?", rehashed)
+
+def content_digest_bytes(data):
+    """Digest of contract source bytes, used to recognise identical contracts
+
+    Prefixed with the algorithm so digests from environments with and without
+    BLAKE3 never compare equal by accident.
+    """
+    hasher = new_hasher()
+    hasher.update(data)
+    return f"{HASH_ALGORITHM}:{hasher.hexdigest()}"
+
+def content_digest(content):
+    """Digest of contract source text (see read_contract_file)"""
+    return content_digest_bytes(content.encode("utf-8"))
+
+def load_analysis_by_content(content_sha, model):
+    """Return an earlier analysis of identical contract source by the same model, as a dict of reports"""
+    with db_lock:
+        row = get_db().execute("""
+            SELECT functions_report, journey_report, journey_diagram, call_diagram
+            FROM contracts
+            WHERE content_sha = ? AND model = ?
+            ORDER BY analysed_at DESC LIMIT 1
+        """, (content_sha, model)).fetchone()
+    if not row or not all(row):
+        return None
+    # Don't reuse an analysis whose LLM calls failed, or whose diagrams were cut off
+    # (e.g. by the generation cap) before any Mermaid code was produced. Such rows,
+    # including think-only replies stored by earlier versions, are replaced on re-analysis
+    if any(report.startswith("Unable to generate analysis") for report in row):
+        return None
+    if not (has_mermaid_diagram(row["journey_diagram"]) and has_mermaid_diagram(row["call_diagram"])):
+        return None
+    return dict(zip(row.keys(), row))
+
+SAVE_ANALYSIS_SQL = """
+   INSERT OR REPLACE INTO contracts
+   (id, filename, content, functions_report, journey_report, journey_diagram, call_diagram, analysed_at,
+    content_sha, model)
+   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def save_analysis(contract_id, filename, content, functions_report, journey_report, journey_diagram, call_diagram,
+                  content_sha=None, model=None, pending=None):
+    """Store a contract analysis, or queue the row on `pending` for save_analyses to write later"""
+    row = (contract_id, filename, content, functions_report, journey_report, journey_diagram, call_diagram,
+           datetime.now().isoformat(), content_sha, model)
+    if pending is not None:
+        pending.append(row)
+        return
+    with db_lock:
+        get_db().execute(SAVE_ANALYSIS_SQL, row)
+
+def save_analyses(rows):
+    """Write queued contract analyses in a single transaction"""
+    if not rows:
+        return
+    with db_lock:
+        conn = get_db()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(SAVE_ANALYSIS_SQL, rows)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
 
 def save_document_analysis(doc_id, source_type, source_path, content, summary, key_highlights, 
                            contract_breakdown, function_breakdown, mechanics_diagram):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute("""
-       INSERT OR REPLACE INTO documents
-       (id, source_type, source_path, content, summary, key_highlights, contract_breakdown, 
-        function_breakdown, mechanics_diagram, analysed_at)
-       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (doc_id, source_type, source_path, content, summary, key_highlights, contract_breakdown, 
-           function_breakdown, mechanics_diagram, datetime.now().isoformat()))
-    conn.commit()
-    conn.close()
+    with db_lock:
+        get_db().execute("""
+           INSERT OR REPLACE INTO documents
+           (id, source_type, source_path, content, summary, key_highlights, contract_breakdown, 
+            function_breakdown, mechanics_diagram, analysed_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (doc_id, source_type, source_path, content, summary, key_highlights, contract_breakdown, 
+               function_breakdown, mechanics_diagram, datetime.now().isoformat()))
 
 # -------------------------------
 # LLM API Interaction Functions
 # -------------------------------
+# Shared, never-mutated pieces of every chat request
+SYSTEM_MESSAGE = {"role": "system", "content": "You are a smart contract and protocol documentation analyzer."}
+
+@functools.lru_cache(maxsize=None)
+def openrouter_headers(api_key, data_usage):
+    """OpenRouter request headers, built once per API key and data usage policy (do not mutate)"""
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "https://github.com/pxng0lin/DeepCurrent",  # Required for data policies
+        "X-Title": "DeepCurrent Smart Contract Analyzer",  # Required for data policies
+        "X-Data-Usage": data_usage  # Control data usage policy
+    }
+
 async def init_async_session():
-    global async_session
+    global async_session, async_ollama_clients, async_ollama_client_cycle
     if async_session is None:
-        async_session = aiohttp.ClientSession()
+        connector = aiohttp.TCPConnector(limit=16, limit_per_host=16, keepalive_timeout=75)
+        async_session = aiohttp.ClientSession(connector=connector)
+    if async_ollama_clients is None:
+        async_ollama_clients = [ollama.AsyncClient(host=host) for host in OLLAMA_HOSTS]
+        async_ollama_client_cycle = itertools.cycle(async_ollama_clients)
 
 async def close_async_session():
-    global async_session
+    global async_session, async_ollama_clients, async_ollama_client_cycle
     if async_session:
         await async_session.close()
         async_session = None
-
-async def call_openrouter_async(prompt, model=None, max_retries=3, initial_backoff=1):
-    """Call OpenRouter API with streaming support - following their documentation"""
+    # The Ollama clients are bound to the running event loop, so close their httpx pools
+    # (ollama.AsyncClient keeps one in _client) and drop them with the session
+    for client in async_ollama_clients or []:
+        await client._client.aclose()
+    async_ollama_clients = None
+    async_ollama_client_cycle = None
+
+def truncate_prompt(prompt):
+    """Cut down extremely long prompts to avoid API issues"""
+    if len(prompt) > MAX_PROMPT_LENGTH:
+        prompt = prompt[:MAX_PROMPT_LENGTH] + "\n\n[Note: Prompt was truncated due to length]\n"
+    return prompt
+
+async def call_openrouter_async(prompt, model=None, max_retries=3, initial_backoff=1, max_tokens=None,
+                                answered_by=None, cache_if=None):
+    """Call OpenRouter API with streaming support - following their documentation
+
+    Retries the requested model like call_llm does. Other OPENROUTER_MODELS are only tried
+    when OPENROUTER_FALLBACK is set.
+    If answered_by is a list, the model that produced a successful reply is appended to it.
+    If cache_if is given, a reply is only cached when cache_if(reply) is true.
+    """
     if model is None:
         model = "deepseek/deepseek-v3-base:free"  # Default OpenRouter model
 
     # Check cache first
-    cache_key = hashlib.sha256((prompt + model + "openrouter").encode()).hexdigest()
-    cached_response = cache.get(cache_key)
+    cache_key = llm_cache_key(prompt, model, "openrouter")
+    cached_response = get_cached_response(cache_key)
     if cached_response:
         return cached_response
 
-    # Convert the prompt to OpenRouter's expected format
-    messages = [{"role": "user", "content": prompt}]
+    # Same system message, temperature and token default as the synchronous call_llm,
+    # so moving a phase onto the async path doesn't change what the model is asked
+    messages = [SYSTEM_MESSAGE, {"role": "user", "content": prompt}]
 
     # Add required headers including HTTP_REFERER and X-Title for data policy - exactly as in docs
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "https://github.com/pxng0lin/DeepCurrent",  # Required for data policies
-        "X-Title": "DeepCurrent Smart Contract Analyzer",  # Required for data policies
-        "X-Data-Usage": OPENROUTER_DATA_USAGE  # Control data usage policy
-    }
+    headers = openrouter_headers(OPENROUTER_API_KEY, OPENROUTER_DATA_USAGE)
     
     # Simplified payload following the OpenRouter examples
     payload = {
         "model": model,
         "messages": messages,
+        "max_tokens": max_tokens or 20000,
+        "temperature": 0.1,
         "stream": True
     }
     
-    # Retry with exponential backoff
-    retry_count = 0
-    backoff = initial_backoff
-    
-    # Try main model first, then fall back to backup models if needed
-    backup_models = OPENROUTER_MODELS.copy()
-    if model in backup_models:
-        backup_models.remove(model)
-    
-    models_to_try = [model] + backup_models
+    models_to_try = [model]
+    if OPENROUTER_FALLBACK:
+        models_to_try += [backup for backup in OPENROUTER_MODELS if backup != model]
     
     for attempt, current_model in enumerate(models_to_try):
         if attempt > 0:
             console.print(f"[yellow]Attempting fallback model: {current_model}[/yellow]")
             payload["model"] = current_model
         
-        try:
-            await init_async_session()
-            console.print(f"[cyan]Calling OpenRouter with model: {current_model}[/cyan]")
-            response = ""
-            
-            async with async_session.post(OPENROUTER_API_URL, 
-                                        json=payload, 
-                                        headers=headers) as resp:
-                if resp.status != 200:
-                    error_text = await resp.text()
-                    console.print(f"[yellow]Error {resp.status} from OpenRouter: {error_text}[/yellow]")
-                    if attempt < len(models_to_try) - 1:
-                        await asyncio.sleep(backoff)  # Wait before retry
-                        backoff *= 2  # Exponential backoff
-                        continue
-                    else:
-                        # Last model failed, return fallback response
-                        return "Unable to generate analysis. Please try a different model or provider."
+        # Retry with exponential backoff, as call_llm does
+        backoff = initial_backoff
+        for retry in range(max_retries + 1):
+            try:
+                await init_async_session()
+                console.print(f"[cyan]Calling OpenRouter with model: {current_model}[/cyan]")
+                # Collect deltas in a list and join once; str += on every chunk is quadratic
+                parts = []
                 
-                # Process the streaming response
-                async for chunk in resp.content:
-                    if not chunk:
-                        continue
-                        
-                    # Convert chunk to text and handle 'data: ' prefix
-                    chunk_text = chunk.decode('utf-8')
-                    if chunk_text.startswith('data: '):
-                        chunk_text = chunk_text[6:]
+                async with async_session.post(OPENROUTER_API_URL, 
+                                            data=json_dumps_bytes(payload), 
+                                            headers=headers) as resp:
+                    if resp.status in (401, 403):
+                        # Bad key or no access: neither retrying nor another model will help
+                        error_text = await resp.text()
+                        console.print(f"[bold red]Error {resp.status} from OpenRouter:[/bold red] {error_text}")
+                        return "Unable to generate analysis. Please check your OpenRouter API key."
+                    if resp.status != 200:
+                        error_text = await resp.text()
+                        raise ValueError(f"Error {resp.status} from OpenRouter: {error_text}")
                     
-                    # Skip [DONE] messages
-                    if chunk_text.strip() == '[DONE]':
-                        continue
+                    # Process the streaming response line by line, parsing the raw bytes
+                    async for chunk in resp.content:
+                        # Only 'data: ' lines carry events; skip blank separators and keep-alive comments
+                        if not chunk.startswith(b'data: '):
+                            continue
+                        chunk_text = chunk[6:].strip()
                         
-                    # Parse JSON chunk
-                    try:
-                        chunk_data = json.loads(chunk_text)
-                        if 'choices' in chunk_data and chunk_data['choices'] and 'delta' in chunk_data['choices'][0]:
-                            delta = chunk_data['choices'][0]['delta']
-                            if 'content' in delta and delta['content']:
-                                response += delta['content']
-                    except json.JSONDecodeError as e:
-                        console.print(f"[yellow]JSON decode error: {e}[/yellow]")
-                        console.print(f"Problematic chunk: {chunk_text}")
-            
-            # Store in cache and return accumulated response
-            if response:
-                cache.set(cache_key, response, expire=CACHE_EXPIRY)
-                return response
-            else:
-                if attempt < len(models_to_try) - 1:
-                    await asyncio.sleep(backoff)
-                    backoff *= 2
-                    continue
-                else:
-                    # Last model failed, return fallback response
-                    return "Unable to generate analysis. Please try a different model or provider."
-                    
-        except Exception as e:
-            console.print(f"[yellow]Error with {current_model}: {e}[/yellow]")
-            if attempt < len(models_to_try) - 1:
-                await asyncio.sleep(backoff)
+                        # Skip [DONE] messages
+                        if chunk_text == b'[DONE]':
+                            continue
+                            
+                        # Parse JSON chunk
+                        try:
+                            chunk_data = json_loads(chunk_text)
+                            if 'choices' in chunk_data and chunk_data['choices'] and 'delta' in chunk_data['choices'][0]:
+                                delta = chunk_data['choices'][0]['delta']
+                                if 'content' in delta and delta['content']:
+                                    parts.append(delta['content'])
+                        except json.JSONDecodeError as e:
+                            console.print(f"[yellow]JSON decode error: {e}[/yellow]")
+                            console.print(f"Problematic chunk: {chunk_text.decode('utf-8', 'replace')}")
+                
+                response = "".join(parts)
+                # Store in cache and return accumulated response. A fallback model's reply is cached
+                # under that model, so it is never served as the requested model's answer
+                if response:
+                    if cache_if is None or cache_if(response):
+                        if current_model != model:
+                            cache_key = llm_cache_key(prompt, current_model, "openrouter")
+                        cache.set(cache_key, response, expire=CACHE_EXPIRY)
+                    if answered_by is not None:
+                        answered_by.append(current_model)
+                    return response
+                console.print(f"[yellow]Empty response from {current_model} (attempt {retry+1}/{max_retries+1})[/yellow]")
+                        
+            except Exception as e:
+                console.print(f"[yellow]Error with {current_model} (attempt {retry+1}/{max_retries+1}): {e}[/yellow]")
+            
+            if retry < max_retries:
+                # Exponential backoff with jitter
+                await asyncio.sleep(backoff * (1 + random.random() * 0.1))
                 backoff *= 2
-                continue
-            else:
-                # Last model failed, return fallback response
-                return "Unable to generate analysis. Please try a different model or provider."
     
-    # We should never reach here, but just in case
+    console.print("[bold red]All attempts to call OpenRouter failed.[/bold red]")
     return "Unable to generate analysis. Please try a different model or provider."
 
-async def call_ollama_async(prompt, model=None, max_retries=3, initial_backoff=1):
-    """Call Ollama API using chat API from ollama-python library"""
+async def call_ollama_async(prompt, model=None, max_retries=3, initial_backoff=1, max_tokens=None, cache_if=None):
+    """Call Ollama API using chat API from ollama-python library
+
+    If cache_if is given, a reply is only cached when cache_if(reply) is true.
+    """
     if model is None:
         model = MODEL_NAME
 
     # Check cache first
-    cache_key = hashlib.sha256((prompt + model + "ollama").encode()).hexdigest()
-    cached_response = cache.get(cache_key)
+    cache_key = llm_cache_key(prompt, model, "ollama")
+    cached_response = get_cached_response(cache_key)
     if cached_response:
         return cached_response
 
+    options = {"temperature": 0.1}
+    if max_tokens:
+        options["num_predict"] = max_tokens
+    
     # Retry with exponential backoff
     retry_count = 0
     backoff = initial_backoff
     
     while retry_count <= max_retries:
         try:
+            await init_async_session()
             console.print(f"[cyan]Calling Ollama with model: {model}[/cyan]")
             
-            # Use the ollama-python client with chat API
-            response = ollama.chat(
+            # Use the async ollama-python client so concurrent calls don't block the event loop,
+            # and stream the reply so tokens are consumed as they are decoded
+            stream = await next(async_ollama_client_cycle).chat(
                 model=model,
-                messages=[
-                    {
-                        'role': 'system',
-                        'content': 'You are a smart contract and protocol documentation analyzer.'
-                    },
-                    {
-                        'role': 'user',
-                        'content': prompt
-                    }
-                ],
-                options={
-                    "temperature": 0.1
-                }
+                messages=[SYSTEM_MESSAGE, {'role': 'user', 'content': prompt}],
+                options=options,
+                stream=True
             )
             
-            # Extract content from Pydantic model response
-            content = ""
-            if hasattr(response, 'message') and hasattr(response.message, 'content'):
-                content = response.message.content
+            parts = []
+            async for chunk in stream:
+                parts.append(chunk['message']['content'] or "")
+            content = "".join(parts)
             
             # Store in cache and return content
             if content:
-                cache.set(cache_key, content, expire=CACHE_EXPIRY)
+                if cache_if is None or cache_if(content):
+                    cache.set(cache_key, content, expire=CACHE_EXPIRY)
                 return content
             else:
                 if retry_count < max_retries:
@@ -435,67 +646,109 @@ async def call_ollama_async(prompt, model=None, max_retries=3, initial_backoff=1
     # We should never reach here, but just in case
     return "Unable to generate analysis. Please try a different model or provider."
 
-async def call_llm_async(prompt, model=None, max_retries=3, initial_backoff=1):
-    """Main async function to call LLM - routes to appropriate provider"""
-    if LLM_PROVIDER == "openrouter":
-        return await call_openrouter_async(prompt, model, max_retries, initial_backoff)
-    else:  # Default to Ollama
-        return await call_ollama_async(prompt, model, max_retries, initial_backoff)
+# Requests currently being generated, keyed like the response cache. Identical prompts issued
+# concurrently (e.g. duplicate contracts in one directory) would all miss the cache, so later
+# callers await the first request instead of sending their own.
+inflight_llm_calls = {}
+
+# Set to a set() by a caller that needs to know which models answered its async LLM calls
+# (OpenRouter may fall back to another model); tasks it spawns share the same set
+llm_models_used = contextvars.ContextVar("llm_models_used", default=None)
+
+async def call_llm_async(prompt, model=None, max_retries=3, initial_backoff=1, max_tokens=None, cache_if=None):
+    """Main async function to call LLM - routes to appropriate provider
+
+    cache_if, if given, decides whether a reply is worth caching (e.g. a diagram that was cut off isn't).
+    """
+    prompt = truncate_prompt(prompt)
+    key = (llm_cache_key(prompt, model, LLM_PROVIDER), max_tokens)
+    inflight = inflight_llm_calls.get(key)
+    if inflight is None:
+        answered_by = []
+        if LLM_PROVIDER == "openrouter":
+            call = call_openrouter_async(prompt, model, max_retries, initial_backoff, max_tokens, answered_by, cache_if)
+        else:  # Default to Ollama
+            call = call_ollama_async(prompt, model, max_retries, initial_backoff, max_tokens, cache_if)
+        inflight = (asyncio.ensure_future(call), answered_by)
+        inflight_llm_calls[key] = inflight
+        inflight[0].add_done_callback(lambda _: inflight_llm_calls.pop(key, None))
+    task, answered_by = inflight
+    # Shielded so one caller being cancelled doesn't cancel the request for the others
+    response = await asyncio.shield(task)
+    models_used = llm_models_used.get()
+    if models_used is not None:
+        models_used.add(answered_by[-1] if answered_by else model)
+    return response
 
 # Define both synchronous and async versions of the LLM call function
-def call_llm(prompt, model=None, max_retries=3, backoff_factor=2):
+def call_llm(prompt, model=None, max_retries=3, backoff_factor=2, max_tokens=None):
     """Synchronous LLM call function with retries and improved error handling"""
     if model is None:
         model = ANALYSIS_MODEL
     
-    # Cut down extremely long prompts to avoid API issues
-    max_prompt_length = 12000  # Characters
-    if len(prompt) > max_prompt_length:
-        prompt = prompt[:max_prompt_length] + "\n\n[Note: Prompt was truncated due to length]\n"
+    prompt = truncate_prompt(prompt)
+    
+    # Identical prompts (e.g. re-running an unchanged contract) are served from the cache
+    cache_key = llm_cache_key(prompt, model, LLM_PROVIDER)
+    cached_response = get_cached_response(cache_key)
+    if cached_response:
+        return cached_response
         
     if LLM_PROVIDER == "openrouter":
         retries = 0
         wait_time = 1  # Initial wait time in seconds
         
+        # Headers and body don't change between attempts, so build and encode them once
+        headers = openrouter_headers(OPENROUTER_API_KEY, OPENROUTER_DATA_USAGE)
+        body = json_dumps_bytes({
+            "model": model,
+            "messages": [SYSTEM_MESSAGE, {"role": "user", "content": prompt}],
+            "max_tokens": max_tokens or 20000,
+            "temperature": 0.1,
+            "stream": True,
+        })
+        
         while retries <= max_retries:
             try:
-                headers = {
-                    "HTTP-Referer": "https://github.com/",
-                    "Authorization": f"Bearer {OPENROUTER_API_KEY}"
-                }
-                
-                payload = {
-                    "model": model,
-                    "messages": [
-                        {"role": "system", "content": "You are a smart contract and protocol documentation analyzer."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    "max_tokens": 20000,
-                    "temperature": 0.1,
-                }
-                
-                response = requests.post(
+                # Stream the completion as server-sent events so tokens are consumed as they
+                # are generated instead of buffering one large JSON body
+                with http_session.post(
                     "https://openrouter.ai/api/v1/chat/completions",
                     headers=headers,
-                    json=payload,
-                    timeout=60  # Add explicit timeout
-                )
-                
-                # Check if response is valid
-                response.raise_for_status()
-                response_json = response.json()
+                    data=body,
+                    timeout=60,  # Add explicit timeout (per read while streaming)
+                    stream=True
+                ) as response:
+                    # Check if response is valid
+                    response.raise_for_status()
+                    
+                    parts = []
+                    saw_choices = False
+                    for line in response.iter_lines():
+                        # Skip keep-alive comments and blank separators
+                        if not line.startswith(b"data: "):
+                            continue
+                        data = line[6:]
+                        if data.strip() == b"[DONE]":
+                            break
+                        chunk = json_loads(data)
+                        if "error" in chunk:
+                            raise ValueError(f"OpenRouter returned an error mid-stream - {chunk['error']}")
+                        if not chunk.get("choices"):
+                            continue
+                        saw_choices = True
+                        delta = chunk["choices"][0].get("delta") or {}
+                        if delta.get("content"):
+                            parts.append(delta["content"])
                 
                 # Validate response structure
-                if "choices" not in response_json or len(response_json["choices"]) == 0:
-                    raise ValueError(f"Invalid API response structure: 'choices' missing or empty - {response_json}")
-                    
-                if "message" not in response_json["choices"][0]:
-                    raise ValueError(f"Invalid API response structure: 'message' missing - {response_json}")
-                    
-                if "content" not in response_json["choices"][0]["message"]:
-                    raise ValueError(f"Invalid API response structure: 'content' missing - {response_json}")
+                if not saw_choices:
+                    raise ValueError("Invalid API response structure: no 'choices' in streamed response")
                 
-                return response_json["choices"][0]["message"]["content"]
+                content = "".join(parts)
+                if content:
+                    cache.set(cache_key, content, expire=CACHE_EXPIRY)
+                return content
                 
             except requests.exceptions.RequestException as e:
                 # Network errors, timeouts, HTTP errors
@@ -527,28 +780,22 @@ The system will continue with limited functionality.
 Please check your API key or network connection and try again later."""
 
     else:  # Use Ollama
+        options = {"temperature": 0.1}
+        if max_tokens:
+            options["num_predict"] = max_tokens
         try:
-            # Use the ollama-python client with chat API
-            response = ollama.chat(
+            # Use the ollama-python client with chat API, streaming the reply as it is decoded
+            stream = next(ollama_client_cycle).chat(
                 model=model,
-                messages=[
-                    {
-                        'role': 'system',
-                        'content': 'You are a smart contract and protocol documentation analyzer.'
-                    },
-                    {
-                        'role': 'user',
-                        'content': prompt
-                    }
-                ],
-                options={
-                    "temperature": 0.1
-                }
+                messages=[SYSTEM_MESSAGE, {'role': 'user', 'content': prompt}],
+                options=options,
+                stream=True
             )
             
-            # Access attribute from Pydantic model
-            if hasattr(response, 'message') and hasattr(response.message, 'content'):
-                return response.message.content
+            content = "".join(chunk['message']['content'] or "" for chunk in stream)
+            if content:
+                cache.set(cache_key, content, expire=CACHE_EXPIRY)
+                return content
             return 'No response from Ollama'
         except Exception as e:
             console.print(f"[bold red]Error calling Ollama API:[/bold red] {e}")
@@ -557,22 +804,37 @@ Please check your API key or network connection and try again later."""
 # -------------------------------
 # Helper: Extract Mermaid Code
 # -------------------------------
+# Matches "[label (detail) rest]" node labels, which break Mermaid; HTML spans are left alone.
+# Compiled once because it runs over every generated diagram.
+MERMAID_PARENS_RE = re.compile(r'\[([^\]<>]*?)\(([^\)]+?)\)([^\]<>]*?)\]')
+# Fenced ```mermaid blocks, and bare "flowchart XX" diagrams the model didn't fence (at the start of a line)
+MERMAID_BLOCK_RE = re.compile(r'```mermaid([\s\S]*?)```')
+MERMAID_BARE_FLOWCHART_RE = re.compile(r'(?:\A|(?<=\n))[ \t]*(flowchart [A-Z][A-Z][\s\S]*?)(?:##|$|\Z)')
+# Reasoning models (e.g. deepseek-r1) think aloud first; a reply cut off by the token cap
+# can end inside a <think> block that is never closed
+THINK_BLOCK_RE = re.compile(r'<think>[\s\S]*?(?:</think>|\Z)')
+
 def extract_mermaid_code(text):
     """Extract mermaid code from a text string"""
-    mermaid_pattern = r'```mermaid([\s\S]*?)```'
-    matches = re.findall(mermaid_pattern, text)
+    # A diagram mentioned or drafted while thinking isn't the answer
+    text = THINK_BLOCK_RE.sub('', text)
+    # Only the first block is used, so stop at the first match
+    match = MERMAID_BLOCK_RE.search(text)
     
-    if matches:
+    if match:
         # Found mermaid code block(s)
-        return '```mermaid' + matches[0] + '```'
+        return '```mermaid' + match.group(1) + '```'
     else:
         # Try another common format
-        alternate_pattern = r'(flowchart [A-Z][A-Z][\s\S]*?)(?:##|$|\Z)'
-        matches = re.findall(alternate_pattern, text)
-        if matches:
-            return '```mermaid\n' + matches[0].strip() + '\n```'
+        match = MERMAID_BARE_FLOWCHART_RE.search(text)
+        if match:
+            return '```mermaid\n' + match.group(1).strip() + '\n```'
         return None
 
+def has_mermaid_diagram(text):
+    """Whether a reply contains Mermaid code (fenced, or a bare flowchart) outside any <think> block"""
+    return extract_mermaid_code(text) is not None
+
 # -------------------------------
 # Document Content Extraction
 # -------------------------------
@@ -580,6 +842,8 @@ def extract_pdf_content(pdf_path):
     """Extract text content from a PDF file"""
     text_content = ""
     try:
+        # Pages are collected and joined once; += on a growing string copies it every page
+        pages = []
         # Using PDFPlumber to extract text
         with pdfplumber.open(pdf_path) as pdf:
             total_pages = len(pdf.pages)
@@ -592,7 +856,8 @@ def extract_pdf_content(pdf_path):
                 for i, page in enumerate(pdf.pages):
                     progress.update(task, description=f"Page {i+1}/{total_pages}", advance=1)
                     page_text = page.extract_text() or ""
-                    text_content += f"\n--- Page {i+1} ---\n{page_text}"
+                    pages.append(f"\n--- Page {i+1} ---\n{page_text}")
+        text_content = "".join(pages)
         
         console.print(f"[green]Successfully extracted content from {pdf_path} ({total_pages} pages)[/green]")
         return text_content
@@ -604,7 +869,7 @@ def extract_pdf_content(pdf_path):
             try:
                 console.print("[yellow]Trying alternative PDF extraction method...[/yellow]")
                 doc = fitz.open(pdf_path)
-                text_content = ""
+                pages = []
                 total_pages = len(doc)
                 
                 with Progress(
@@ -616,7 +881,8 @@ def extract_pdf_content(pdf_path):
                     for i in range(total_pages):
                         progress.update(task, description=f"Page {i+1}/{total_pages}", advance=1)
                         page = doc.load_page(i)
-                        text_content += f"\n--- Page {i+1} ---\n{page.get_text()}"
+                        pages.append(f"\n--- Page {i+1} ---\n{page.get_text()}")
+                text_content = "".join(pages)
                 
                 console.print(f"[green]Successfully extracted content using alternative method[/green]")
                 return text_content
@@ -693,7 +959,7 @@ def extract_url_content_sync(url):
         console.print(f"[cyan]Fetching content from URL: {url}[/cyan]")
         
         # Use requests for synchronous HTTP request
-        response = requests.get(url)
+        response = http_session.get(url)
         if response.status_code != 200:
             console.print(f"[bold red]Error {response.status_code} from URL[/bold red]")
             return f"Error fetching URL content: HTTP {response.status_code}"
@@ -757,17 +1023,110 @@ def extract_document_content(source_path, source_type=None):
     return content, source_type
 
 # -------------------------------
-# Document Analysis Generation
+# Prompt Templates
 # -------------------------------
-def generate_documentation_summary(doc_content):
-    """Generate a summary of the documentation"""
-    prompt = f"""
-# Protocol Documentation Analysis Task: Generate Summary
+# Prompts keep all static instructions ahead of the contract, report or document
+# they describe, so every request of a kind starts with the same bytes and the
+# LLM server can reuse its cached prompt prefix instead of re-processing it.
+# They are built once at import time; each call only appends its content.
+MERMAID_SYNTAX_REQUIREMENTS = """## IMPORTANT SYNTAX REQUIREMENTS:
+1. DO NOT use parentheses '(' or ')' in node IDs or labels as they cause syntax errors in Mermaid
+2. Instead, use one of these alternatives:
+   - Replace parentheses with square brackets '[' and ']'
+   - Replace parentheses with curly braces '{' and '}'
+   - Simply remove the parentheses
+   - Use special formatting like HTML entities, e.g., &lpar; and &rpar; if within HTML spans
+"""
 
-Analyze the following protocol documentation and generate a concise summary that captures the essence of the protocol.
+MECHANICS_DIAGRAM_PROMPT = """
+# Protocol Documentation Analysis Task: Mechanics Diagram
+
+Analyze the protocol documentation given at the end of this prompt and create detailed Mermaid diagrams that visualize the protocol's mechanics.
+
+## Instructions:
+1. Create multiple Mermaid diagrams to represent different aspects of the protocol:
+   - Core protocol flow (flowchart TD)
+   - Contract interaction diagram (flowchart LR)
+   - User journey/interaction flows (flowchart TD)
+   - Token or asset flows (flowchart LR)
+2. Label all nodes and edges clearly.
+3. Use appropriate colors and styles to differentiate between actors, contracts, and processes.
+4. Include brief explanatory text before each diagram.
+
+""" + MERMAID_SYNTAX_REQUIREMENTS + """3. For function descriptions, use a hyphen or colon instead of parentheses
+   Example: "checkAccess - onlyOwner" instead of "checkAccess (onlyOwner)"
+
+For each diagram, use the following Mermaid syntax:
+```mermaid
+flowchart TD or flowchart LR
+... your diagram nodes and connections here ...
+```
+
+Provide at least 3 different diagrams covering different aspects of the protocol.
 
 ## Documentation Content:
-{doc_content[:20000]}  # Limiting to 20k chars to avoid token limits
+"""
+
+JOURNEY_DIAGRAM_PROMPT = """
+# Smart Contract Diagram Task: User Journey Visualization
+
+Based on the journey report given at the end of this prompt, create a comprehensive Mermaid diagram that visualizes the contract's user journeys and workflows.
+
+## Instructions:
+1. Create a detailed Mermaid flowchart diagram (TD - top-down) that shows:
+   - Main user journeys through the contract
+   - Key decision points and conditional paths
+   - State transitions and their triggers
+   - Different user roles and their interactions
+2. Use appropriate colors and styles to distinguish different components
+3. Include clear labels for all nodes and connections
+4. Focus on the most important flows while maintaining readability
+
+""" + MERMAID_SYNTAX_REQUIREMENTS + """3. For function descriptions, use a hyphen or colon instead of parentheses
+   Example: "checkAccess - onlyOwner" instead of "checkAccess (onlyOwner)"
+
+Provide ONLY the Mermaid diagram code in the following format:
+```mermaid
+flowchart TD
+... your diagram nodes and connections here ...
+```
+
+## Journey Report:
+"""
+
+CALL_DIAGRAM_PROMPT = """
+# Smart Contract Diagram Task: Function Call Visualization
+
+Based on the functions report given at the end of this prompt, create a comprehensive Mermaid diagram that visualizes the function call relationships in the contract.
+
+## Instructions:
+1. Create a detailed Mermaid diagram that shows:
+   - Functions and their relationships
+   - Call patterns between functions
+   - Access control and visibility relationships
+   - Inheritance and override patterns
+2. IMPORTANT: Use ONLY one diagram type - flowchart LR (left to right)
+3. Use colors and styles to distinguish different function types (public, private, etc.)
+4. Include clear labels for all nodes and connections
+5. Keep the diagram to a single flowchart - DO NOT include multiple diagram types
+
+""" + MERMAID_SYNTAX_REQUIREMENTS + """3. For visibility and access modifiers, use a hyphen or colon instead of parentheses
+   Example: "Constructor - internal" instead of "Constructor (internal)"
+4. DO NOT include a classDiagram section - only use a single flowchart LR
+
+Provide ONLY the Mermaid diagram code in the following format:
+```mermaid
+flowchart LR
+... your diagram nodes and connections here ...
+```
+
+## Functions Report:
+"""
+
+DOC_SUMMARY_PROMPT = """
+# Protocol Documentation Analysis Task: Generate Summary
+
+Analyze the protocol documentation given at the end of this prompt and generate a concise summary that captures the essence of the protocol.
 
 ## Instructions:
 1. Provide an executive summary (2-3 paragraphs) that explains what this protocol does and its primary purpose.
@@ -776,21 +1135,14 @@ Analyze the following protocol documentation and generate a concise summary that
 4. Note any distinguishing features or innovations.
 
 Format your response as clean markdown.
+
+## Documentation Content:
 """
-    
-    console.print("[cyan]Generating documentation summary...[/cyan]")
-    summary = call_llm(prompt, ANALYSIS_MODEL)
-    return summary
 
-def generate_key_highlights(doc_content):
-    """Generate key highlights from the documentation"""
-    prompt = f"""
+DOC_HIGHLIGHTS_PROMPT = """
 # Protocol Documentation Analysis Task: Extract Key Highlights
 
-Analyze the following protocol documentation and extract the key highlights and important aspects.
-
-## Documentation Content:
-{doc_content[:20000]}  # Limiting to 20k chars to avoid token limits
+Analyze the protocol documentation given at the end of this prompt and extract the key highlights and important aspects.
 
 ## Instructions:
 1. Identify 5-10 key highlights or important aspects of this protocol.
@@ -799,21 +1151,14 @@ Analyze the following protocol documentation and extract the key highlights and
 4. Note any governance mechanisms or token economics (if applicable).
 
 Format your response as a bulleted list in clean markdown.
+
+## Documentation Content:
 """
-    
-    console.print("[cyan]Extracting key highlights...[/cyan]")
-    highlights = call_llm(prompt, ANALYSIS_MODEL)
-    return highlights
 
-def generate_contract_breakdown(doc_content):
-    """Generate a breakdown of contracts mentioned in the documentation"""
-    prompt = f"""
+DOC_CONTRACT_BREAKDOWN_PROMPT = """
 # Protocol Documentation Analysis Task: Contract Breakdown
 
-Analyze the following protocol documentation and provide a detailed breakdown of all the smart contracts mentioned.
-
-## Documentation Content:
-{doc_content[:20000]}  # Limiting to 20k chars to avoid token limits
+Analyze the protocol documentation given at the end of this prompt and provide a detailed breakdown of all the smart contracts mentioned.
 
 ## Instructions:
 1. Identify all smart contracts or contract interfaces mentioned in the documentation.
@@ -826,21 +1171,14 @@ Analyze the following protocol documentation and provide a detailed breakdown of
 3. Organize the contracts by their role in the protocol (e.g., core, periphery, governance).
 
 Format your response as clean markdown with clear hierarchical structure.
+
+## Documentation Content:
 """
-    
-    console.print("[cyan]Generating contract breakdown...[/cyan]")
-    contract_breakdown = call_llm(prompt, ANALYSIS_MODEL)
-    return contract_breakdown
 
-def generate_function_breakdown(doc_content):
-    """Generate a breakdown of key functions mentioned in the documentation"""
-    prompt = f"""
+DOC_FUNCTION_BREAKDOWN_PROMPT = """
 # Protocol Documentation Analysis Task: Function Breakdown
 
-Analyze the following protocol documentation and provide a detailed breakdown of the key functions mentioned.
-
-## Documentation Content:
-{doc_content[:20000]}  # Limiting to 20k chars to avoid token limits
+Analyze the protocol documentation given at the end of this prompt and provide a detailed breakdown of the key functions mentioned.
 
 ## Instructions:
 1. Identify the most important functions mentioned in the documentation.
@@ -853,75 +1191,14 @@ Analyze the following protocol documentation and provide a detailed breakdown of
 3. Organize functions by contract or by protocol flow/lifecycle.
 
 Format your response as clean markdown with code blocks where appropriate.
-"""
-    
-    console.print("[cyan]Generating function breakdown...[/cyan]")
-    function_breakdown = call_llm(prompt, ANALYSIS_MODEL)
-    return function_breakdown
-
-def generate_mechanics_diagram(doc_content):
-    """Generate mermaid diagrams for protocol mechanics"""
-    prompt = f"""
-# Protocol Documentation Analysis Task: Mechanics Diagram
-
-Analyze the following protocol documentation and create detailed Mermaid diagrams that visualize the protocol's mechanics.
 
 ## Documentation Content:
-{doc_content[:20000]}  # Limiting to 20k chars to avoid token limits
-
-## Instructions:
-1. Create multiple Mermaid diagrams to represent different aspects of the protocol:
-   - Core protocol flow (flowchart TD)
-   - Contract interaction diagram (flowchart LR)
-   - User journey/interaction flows (flowchart TD)
-   - Token or asset flows (flowchart LR)
-2. Label all nodes and edges clearly.
-3. Use appropriate colors and styles to differentiate between actors, contracts, and processes.
-4. Include brief explanatory text before each diagram.
-
-## IMPORTANT SYNTAX REQUIREMENTS:
-1. DO NOT use parentheses '(' or ')' in node IDs or labels as they cause syntax errors in Mermaid
-2. Instead, use one of these alternatives:
-   - Replace parentheses with square brackets '[' and ']'
-   - Replace parentheses with curly braces '{' and '}'
-   - Simply remove the parentheses
-   - Use special formatting like HTML entities, e.g., &lpar; and &rpar; if within HTML spans
-3. For function descriptions, use a hyphen or colon instead of parentheses
-   Example: "checkAccess - onlyOwner" instead of "checkAccess (onlyOwner)"
-
-For each diagram, use the following Mermaid syntax:
-```mermaid
-flowchart TD or flowchart LR
-... your diagram nodes and connections here ...
-```
-
-Provide at least 3 different diagrams covering different aspects of the protocol.
 """
-    
-    console.print("[cyan]Generating mechanics diagrams...[/cyan]")
-    diagrams_raw = call_llm(prompt, ANALYSIS_MODEL)
-    
-    # As a fallback, also clean up any remaining parentheses in the generated diagrams
-    # Replace problematic patterns in node definitions
-    # This regex targets function descriptions in brackets but preserves HTML spans
-    import re
-    mechanics_diagrams = re.sub(r'\[([^\]<>]*?)\(([^\)]+?)\)([^\]<>]*?)\]', r'[\1 - \2\3]', diagrams_raw)
-    
-    return mechanics_diagrams
 
-# -------------------------------
-# Smart Contract Analysis Functions
-# -------------------------------
-
-def generate_functions_report(contract_content):
-    """Generate a detailed report of all functions in the smart contract"""
-    prompt = f"""
+FUNCTIONS_REPORT_PROMPT = """
 # Smart Contract Analysis Task: Functions Report
 
-Analyze the following smart contract and create a detailed functions report.
-
-## Contract Content:
-{contract_content[:20000]}  # Limiting to 20k chars to avoid token limits
+Analyze the smart contract given at the end of this prompt and create a detailed functions report.
 
 ## Instructions:
 1. Identify and document all functions in the contract, including:
@@ -938,22 +1215,14 @@ Analyze the following smart contract and create a detailed functions report.
    - Gas optimization opportunities
    - Edge cases or limitations
 3. Format the report in clear Markdown with appropriate headings and sections
+
+## Contract Content:
 """
-    
-    console.print("[cyan]Generating functions report...[/cyan]")
-    functions_report = call_llm(prompt, ANALYSIS_MODEL)
-    
-    return functions_report
 
-def generate_journey_report(contract_content):
-    """Generate a report on the contract's user journey and workflow"""
-    prompt = f"""
+JOURNEY_REPORT_PROMPT = """
 # Smart Contract Analysis Task: User Journey Report
 
-Analyze the following smart contract and create a comprehensive user journey report.
-
-## Contract Content:
-{contract_content[:20000]}  # Limiting to 20k chars to avoid token limits
+Analyze the smart contract given at the end of this prompt and create a comprehensive user journey report.
 
 ## Instructions:
 1. Identify and document the main flows and user journeys through the contract:
@@ -970,52 +1239,105 @@ Analyze the following smart contract and create a comprehensive user journey rep
    - Optimization recommendations
    - Security considerations for users
 4. Format the report in clear Markdown with appropriate headings and sections
+
+## Contract Content:
 """
+
+# -------------------------------
+# Document Analysis Generation
+# -------------------------------
+async def generate_documentation_summary(doc_content):
+    """Generate a summary of the documentation"""
+    # Limiting to 20k chars to avoid token limits
+    prompt = f"{DOC_SUMMARY_PROMPT}{doc_content[:20000]}\n"
     
-    console.print("[cyan]Generating journey report...[/cyan]")
-    journey_report = call_llm(prompt, ANALYSIS_MODEL)
+    console.print("[cyan]Generating documentation summary...[/cyan]")
+    summary = await call_llm_async(prompt, ANALYSIS_MODEL)
+    return summary
+
+async def generate_key_highlights(doc_content):
+    """Generate key highlights from the documentation"""
+    # Limiting to 20k chars to avoid token limits
+    prompt = f"{DOC_HIGHLIGHTS_PROMPT}{doc_content[:20000]}\n"
     
-    return journey_report
+    console.print("[cyan]Extracting key highlights...[/cyan]")
+    highlights = await call_llm_async(prompt, ANALYSIS_MODEL)
+    return highlights
 
-def generate_journey_diagram(journey_report):
-    """Generate a Mermaid diagram visualizing the contract journey"""
-    prompt = f"""
-# Smart Contract Diagram Task: User Journey Visualization
+async def generate_contract_breakdown(doc_content):
+    """Generate a breakdown of contracts mentioned in the documentation"""
+    # Limiting to 20k chars to avoid token limits
+    prompt = f"{DOC_CONTRACT_BREAKDOWN_PROMPT}{doc_content[:20000]}\n"
+    
+    console.print("[cyan]Generating contract breakdown...[/cyan]")
+    contract_breakdown = await call_llm_async(prompt, ANALYSIS_MODEL)
+    return contract_breakdown
 
-Based on the following journey report, create a comprehensive Mermaid diagram that visualizes the contract's user journeys and workflows.
+async def generate_function_breakdown(doc_content):
+    """Generate a breakdown of key functions mentioned in the documentation"""
+    # Limiting to 20k chars to avoid token limits
+    prompt = f"{DOC_FUNCTION_BREAKDOWN_PROMPT}{doc_content[:20000]}\n"
+    
+    console.print("[cyan]Generating function breakdown...[/cyan]")
+    function_breakdown = await call_llm_async(prompt, ANALYSIS_MODEL)
+    return function_breakdown
 
-## Journey Report:
-{journey_report[:20000]}  # Limiting to 20k chars to avoid token limits
+async def generate_mechanics_diagram(doc_content):
+    """Generate mermaid diagrams for protocol mechanics"""
+    # Limiting to 20k chars to avoid token limits
+    prompt = f"{MECHANICS_DIAGRAM_PROMPT}{doc_content[:20000]}\n"
+    
+    console.print("[cyan]Generating mechanics diagrams...[/cyan]")
+    diagrams_raw = await call_llm_async(prompt, ANALYSIS_MODEL)
+    
+    # As a fallback, also clean up any remaining parentheses in the generated diagrams
+    # Replace problematic patterns in node definitions
+    # This regex targets function descriptions in brackets but preserves HTML spans
+    mechanics_diagrams = MERMAID_PARENS_RE.sub(r'[\1 - \2\3]', diagrams_raw)
+    
+    return mechanics_diagrams
 
-## Instructions:
-1. Create a detailed Mermaid flowchart diagram (TD - top-down) that shows:
-   - Main user journeys through the contract
-   - Key decision points and conditional paths
-   - State transitions and their triggers
-   - Different user roles and their interactions
-2. Use appropriate colors and styles to distinguish different components
-3. Include clear labels for all nodes and connections
-4. Focus on the most important flows while maintaining readability
+# -------------------------------
+# Smart Contract Analysis Functions
+# -------------------------------
 
-## IMPORTANT SYNTAX REQUIREMENTS:
-1. DO NOT use parentheses '(' or ')' in node IDs or labels as they cause syntax errors in Mermaid
-2. Instead, use one of these alternatives:
-   - Replace parentheses with square brackets '[' and ']'
-   - Replace parentheses with curly braces '{' and '}'
-   - Simply remove the parentheses
-   - Use special formatting like HTML entities, e.g., &lpar; and &rpar; if within HTML spans
-3. For function descriptions, use a hyphen or colon instead of parentheses
-   Example: "checkAccess - onlyOwner" instead of "checkAccess (onlyOwner)"
+async def generate_functions_report(contract_content):
+    """Generate a detailed report of all functions in the smart contract"""
+    # Limiting to 20k chars to avoid token limits
+    prompt = f"{FUNCTIONS_REPORT_PROMPT}{contract_content[:20000]}\n"
+    
+    console.print("[cyan]Generating functions report...[/cyan]")
+    functions_report = await call_llm_async(prompt, ANALYSIS_MODEL, max_tokens=REPORT_MAX_TOKENS)
+    
+    return functions_report
 
-Provide ONLY the Mermaid diagram code in the following format:
-```mermaid
-flowchart TD
-... your diagram nodes and connections here ...
-```
-"""
+async def generate_journey_report(contract_content):
+    """Generate a report on the contract's user journey and workflow"""
+    # Limiting to 20k chars to avoid token limits
+    prompt = f"{JOURNEY_REPORT_PROMPT}{contract_content[:20000]}\n"
+    
+    console.print("[cyan]Generating journey report...[/cyan]")
+    journey_report = await call_llm_async(prompt, ANALYSIS_MODEL, max_tokens=REPORT_MAX_TOKENS)
+    
+    return journey_report
+
+async def call_llm_for_diagram(prompt):
+    """Call the LLM under DIAGRAM_MAX_TOKENS, retrying once uncapped if the reply has no Mermaid code"""
+    diagram_raw = await call_llm_async(
+        prompt, ANALYSIS_MODEL, max_tokens=DIAGRAM_MAX_TOKENS, cache_if=has_mermaid_diagram
+    )
+    if not has_mermaid_diagram(diagram_raw):
+        # Usually a reasoning model that used up the cap while thinking
+        diagram_raw = await call_llm_async(prompt, ANALYSIS_MODEL, cache_if=has_mermaid_diagram)
+    return diagram_raw
+
+async def generate_journey_diagram(journey_report):
+    """Generate a Mermaid diagram visualizing the contract journey"""
+    # Limiting to 20k chars to avoid token limits
+    prompt = f"{JOURNEY_DIAGRAM_PROMPT}{journey_report[:20000]}\n"
     
     console.print("[cyan]Generating journey diagram...[/cyan]")
-    journey_diagram_raw = call_llm(prompt, ANALYSIS_MODEL)
+    journey_diagram_raw = await call_llm_for_diagram(prompt)
     
     # As a fallback, also clean up any remaining parentheses in the generated diagram
     if "```mermaid" in journey_diagram_raw:
@@ -1027,55 +1349,20 @@ flowchart TD
             
             # Replace problematic patterns in node definitions
             # This regex targets function descriptions in brackets but preserves HTML spans
-            import re
-            cleaned_mermaid = re.sub(r'\[([^\]<>]*?)\(([^\)]+?)\)([^\]<>]*?)\]', r'[\1 - \2\3]', mermaid_code)
+            cleaned_mermaid = MERMAID_PARENS_RE.sub(r'[\1 - \2\3]', mermaid_code)
             
             # Rebuild the response
             journey_diagram_raw = journey_diagram_raw[:mermaid_start] + cleaned_mermaid + journey_diagram_raw[mermaid_end+3:]
     
     return journey_diagram_raw
 
-def generate_call_diagram(functions_report):
+async def generate_call_diagram(functions_report):
     """Generate a Mermaid diagram showing function call relationships"""
-    prompt = f"""
-# Smart Contract Diagram Task: Function Call Visualization
-
-Based on the following functions report, create a comprehensive Mermaid diagram that visualizes the function call relationships in the contract.
-
-## Functions Report:
-{functions_report[:20000]}  # Limiting to 20k chars to avoid token limits
-
-## Instructions:
-1. Create a detailed Mermaid diagram that shows:
-   - Functions and their relationships
-   - Call patterns between functions
-   - Access control and visibility relationships
-   - Inheritance and override patterns
-2. IMPORTANT: Use ONLY one diagram type - flowchart LR (left to right)
-3. Use colors and styles to distinguish different function types (public, private, etc.)
-4. Include clear labels for all nodes and connections
-5. Keep the diagram to a single flowchart - DO NOT include multiple diagram types
-
-## IMPORTANT SYNTAX REQUIREMENTS:
-1. DO NOT use parentheses '(' or ')' in node IDs or labels as they cause syntax errors in Mermaid
-2. Instead, use one of these alternatives:
-   - Replace parentheses with square brackets '[' and ']'
-   - Replace parentheses with curly braces '{' and '}'
-   - Simply remove the parentheses
-   - Use special formatting like HTML entities, e.g., &lpar; and &rpar; if within HTML spans
-3. For visibility and access modifiers, use a hyphen or colon instead of parentheses
-   Example: "Constructor - internal" instead of "Constructor (internal)"
-4. DO NOT include a classDiagram section - only use a single flowchart LR
-
-Provide ONLY the Mermaid diagram code in the following format:
-```mermaid
-flowchart LR
-... your diagram nodes and connections here ...
-```
-"""
+    # Limiting to 20k chars to avoid token limits
+    prompt = f"{CALL_DIAGRAM_PROMPT}{functions_report[:20000]}\n"
     
     console.print("[cyan]Generating call diagram...[/cyan]")
-    call_diagram_raw = call_llm(prompt, ANALYSIS_MODEL)
+    call_diagram_raw = await call_llm_for_diagram(prompt)
     
     # As a fallback, also clean up any remaining parentheses in the generated diagram
     if "```mermaid" in call_diagram_raw:
@@ -1087,8 +1374,7 @@ flowchart LR
             
             # Replace problematic patterns in node definitions
             # This regex targets function descriptions in brackets but preserves HTML spans
-            import re
-            cleaned_mermaid = re.sub(r'\[([^\]<>]*?)\(([^\)]+?)\)([^\]<>]*?)\]', r'[\1 - \2\3]', mermaid_code)
+            cleaned_mermaid = MERMAID_PARENS_RE.sub(r'[\1 - \2\3]', mermaid_code)
             
             # Make sure there's only one diagram type
             if "classDiagram" in cleaned_mermaid:
@@ -1108,30 +1394,71 @@ flowchart LR
 # File Management Functions
 # -------------------------------
 def read_contract_file(filepath):
-    """Read the contents of a contract file"""
+    """Read a contract file, returning (content, content_digest) or (None, None) on failure"""
     try:
-        with open(filepath, 'r', encoding='utf-8') as file:
-            return file.read()
+        data = Path(filepath).read_bytes()
+        # Match text-mode reading, which translates CRLF/CR line endings
+        if b"\r" in data:
+            data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        # Hash the bytes as read rather than re-encoding the decoded text
+        return data.decode('utf-8'), content_digest_bytes(data)
     except Exception as e:
         console.print(f"[bold red]Error reading file:[/bold red] {e}")
-        return None
+        return None, None
+
+def find_contract_files(directory):
+    """List the .sol files directly inside a directory"""
+    # scandir reuses the file type from the directory listing instead of a stat() per entry
+    with os.scandir(directory) as entries:
+        return [entry.path for entry in entries if entry.name.endswith(".sol") and entry.is_file()]
+
+def find_session_dirs():
+    """List the analysis session folders in the current directory"""
+    with os.scandir(os.getcwd()) as entries:
+        return [entry.name for entry in entries if entry.name.startswith("analysis_") and entry.is_dir()]
+
+def find_analysis_dirs(session_folder, contracts=True):
+    """List a session's contract analysis folders (named *.sol), or its document folders"""
+    with os.scandir(session_folder) as entries:
+        return [entry.path for entry in entries if entry.name.endswith(".sol") == contracts and entry.is_dir()]
 
 def save_file(content, filename, output_dir):
     """Save content to a file in the output directory"""
     filepath = os.path.join(output_dir, filename)
     try:
-        with open(filepath, 'w', encoding='utf-8') as file:
-            file.write(content)
+        # Encode once and write the bytes straight to the descriptor, skipping the
+        # text-mode wrapper and its buffering
+        data = memoryview(content.encode('utf-8'))
+        fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            while data:
+                data = data[os.write(fd, data):]
+        finally:
+            os.close(fd)
         return filepath
     except Exception as e:
         console.print(f"[bold red]Error saving file:[/bold red] {e}")
         return None
 
+def copy_file(source_path, filename, output_dir):
+    """Copy a file into the output directory without reading it into memory"""
+    filepath = os.path.join(output_dir, filename)
+    try:
+        shutil.copyfile(source_path, filepath)
+        return filepath
+    except Exception as e:
+        console.print(f"[bold red]Error copying file:[/bold red] {e}")
+        return None
+
+async def save_file_async(content, filename, output_dir):
+    """Save content to a file without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, save_file, content, filename, output_dir)
+
 def read_file(filepath):
-    """Read the contents of a file"""
+    """Read the contents of a text file; undecodable bytes are replaced rather than failing the read"""
     try:
-        with open(filepath, 'r', encoding='utf-8') as file:
-            return file.read()
+        return Path(filepath).read_text(encoding='utf-8', errors='replace')
     except Exception as e:
         console.print(f"[bold red]Error reading file:[/bold red] {e}")
         return None
@@ -1141,8 +1468,12 @@ def read_file(filepath):
 # -------------------------------
 async def process_document_async(source_path, output_dir, source_type=None, progress=None):
     """Process a document (PDF, Markdown, or URL) and generate analysis"""
-    # Extract the document content based on its type
-    doc_content, detected_source_type = extract_document_content(source_path, source_type)
+    # Extract the document content based on its type; PDF parsing and URL fetches block,
+    # so run them in a worker thread rather than on the event loop
+    loop = asyncio.get_running_loop()
+    doc_content, detected_source_type = await loop.run_in_executor(
+        None, extract_document_content, source_path, source_type
+    )
     
     if not doc_content:
         console.print(f"[bold red]Failed to extract content from {source_path}[/bold red]")
@@ -1165,7 +1496,7 @@ async def process_document_async(source_path, output_dir, source_type=None, prog
     os.makedirs(doc_dir, exist_ok=True)
     
     # Save the extracted content
-    content_path = save_file(doc_content, "content.txt", doc_dir)
+    content_path = await save_file_async(doc_content, "content.txt", doc_dir)
     if not content_path:
         console.print(f"[bold red]Failed to save extracted content from {source_path}[/bold red]")
         return
@@ -1173,35 +1504,28 @@ async def process_document_async(source_path, output_dir, source_type=None, prog
     # Create a task ID for progress tracking
     task_id = None
     if progress:
-        task_id = progress.add_task("Generating documentation summary...", total=1)
-    
-    # Generate and save analysis components
-    summary = generate_documentation_summary(doc_content)
-    summary_path = save_file(summary, "summary.md", doc_dir)
-    
-    if progress and task_id is not None:
-        progress.update(task_id, description="Extracting key highlights...")
-    key_highlights = generate_key_highlights(doc_content)
-    highlights_path = save_file(key_highlights, "key_highlights.md", doc_dir)
-    
-    if progress and task_id is not None:
-        progress.update(task_id, description="Generating contract breakdown...")
-    contract_breakdown = generate_contract_breakdown(doc_content)
-    contract_path = save_file(contract_breakdown, "contract_breakdown.md", doc_dir)
-    
-    if progress and task_id is not None:
-        progress.update(task_id, description="Generating function breakdown...")
-    function_breakdown = generate_function_breakdown(doc_content)
-    function_path = save_file(function_breakdown, "function_breakdown.md", doc_dir)
+        task_id = progress.add_task(f"Analysing {doc_base}...", total=5)
+    
+    # The five analyses only depend on the document content, so run them concurrently
+    # on the event loop and save each one as soon as it is ready
+    async def run_phase(generate, filename):
+        result = await generate(doc_content)
+        await save_file_async(result, filename, doc_dir)
+        if progress and task_id is not None:
+            progress.update(task_id, advance=1)
+        return result
     
-    if progress and task_id is not None:
-        progress.update(task_id, description="Generating mechanics diagrams...")
-    mechanics_diagram = generate_mechanics_diagram(doc_content)
-    diagram_path = save_file(mechanics_diagram, "mechanics_diagrams.md", doc_dir)
+    summary, key_highlights, contract_breakdown, function_breakdown, mechanics_diagram = await asyncio.gather(
+        run_phase(generate_documentation_summary, "summary.md"),
+        run_phase(generate_key_highlights, "key_highlights.md"),
+        run_phase(generate_contract_breakdown, "contract_breakdown.md"),
+        run_phase(generate_function_breakdown, "function_breakdown.md"),
+        run_phase(generate_mechanics_diagram, "mechanics_diagrams.md")
+    )
     
     # Complete the task
     if progress and task_id is not None:
-        progress.update(task_id, advance=1, description=f"Completed {os.path.basename(doc_dir)}")
+        progress.update(task_id, description=f"Completed {os.path.basename(doc_dir)}")
     
     # Save to database
     save_document_analysis(
@@ -1227,7 +1551,12 @@ def process_document(source_path, output_dir, source_type=None):
         TextColumn("[progress.description]{task.description}"),
         console=console
     ) as progress:
-        asyncio.run(process_document_async(source_path, output_dir, source_type, progress))
+        async def _run():
+            try:
+                return await process_document_async(source_path, output_dir, source_type, progress)
+            finally:
+                await close_async_session()
+        return asyncio.run(_run())
 
 # -------------------------------
 # Interactive Menu Functions
@@ -1320,13 +1649,11 @@ def document_menu(doc_dir):
         elif choice == "5":
             view_file("mechanics_diagrams.md", doc_dir)
         elif choice == "6":
-            # Combine all reports for querying
-            all_content = ""
-            for path in [summary_path, highlights_path, contract_path, function_path, diagram_path]:
-                if os.path.exists(path):
-                    content = read_file(path)
-                    if content:
-                        all_content += "\n\n" + content
+            # Combine this session's report files for querying. The documents table keeps only the
+            # latest analysis per source, so it may not match the files options 1-5 show
+            reports = [read_file(path) for path in [summary_path, highlights_path, contract_path, function_path, diagram_path]
+                       if os.path.exists(path)]
+            all_content = "".join("\n\n" + content for content in reports if content)
             query_report(all_content, doc_base, doc_dir)
         elif choice == "7":
             break
@@ -1336,8 +1663,7 @@ def document_menu(doc_dir):
 def documents_menu_in_session(session_folder):
     """Browse documents analyzed in the current session"""
     # Find all document directories in the session
-    doc_dirs = [os.path.join(session_folder, d) for d in os.listdir(session_folder) 
-               if os.path.isdir(os.path.join(session_folder, d)) and not d.endswith(".sol")]
+    doc_dirs = find_analysis_dirs(session_folder, contracts=False)
     
     if not doc_dirs:
         console.print("[bold yellow]No document analyses found in this session.[/bold yellow]")
@@ -1436,7 +1762,6 @@ def display_document_from_db(doc_id):
     
     # Clean up the temporary directory
     try:
-        import shutil
         shutil.rmtree(temp_dir)
     except Exception as e:
         console.print(f"[yellow]Warning: Could not clean up temporary directory: {e}[/yellow]")
@@ -1444,8 +1769,7 @@ def display_document_from_db(doc_id):
 def contract_menu_in_session(session_folder):
     """Browse contracts analyzed in the current session"""
     # Find all contract directories in the session
-    contract_dirs = [os.path.join(session_folder, d) for d in os.listdir(session_folder) 
-                  if os.path.isdir(os.path.join(session_folder, d)) and d.endswith(".sol")]
+    contract_dirs = find_analysis_dirs(session_folder)
     
     if not contract_dirs:
         console.print("[bold yellow]No contract analyses found in this session.[/bold yellow]")
@@ -1495,8 +1819,7 @@ def session_menu(session_folder):
                 continue
             
             # Process all .sol files in the directory
-            contract_files = [os.path.join(directory, f) for f in os.listdir(directory)
-                            if os.path.isfile(os.path.join(directory, f)) and f.endswith(".sol")]
+            contract_files = find_contract_files(directory)
             if not contract_files:
                 console.print("No smart contract files (.sol) found in the directory.")
                 continue
@@ -1535,7 +1858,7 @@ def session_menu(session_folder):
 def browse_sessions():
     """Browse all analysis sessions"""
     # Get a list of all analysis folders
-    session_dirs = [d for d in os.listdir() if os.path.isdir(d) and d.startswith("analysis_")]
+    session_dirs = find_session_dirs()
     session_dirs.sort(reverse=True)  # Latest first
     
     if not session_dirs:
@@ -1987,11 +2310,11 @@ Return as a valid JSON object with these keys: "category", "detection_patterns",
     conn = sqlite3.connect(DB_NAME)
     cur = conn.cursor()
     
-    for entry in library_entries:
-        cur.execute("""
-            INSERT OR REPLACE INTO vuln_detection_library (id, vuln_type, details, template, created_at)
-            VALUES (?, ?, ?, ?, ?)
-        """, (entry["id"], entry["vuln_type"], entry["details"], entry["template"], entry["created_at"]))
+    cur.executemany("""
+        INSERT OR REPLACE INTO vuln_detection_library (id, vuln_type, details, template, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(entry["id"], entry["vuln_type"], entry["details"], entry["template"], entry["created_at"])
+          for entry in library_entries])
     
     conn.commit()
     conn.close()
@@ -2201,10 +2524,10 @@ def load_contract_content(contract_path):
             console.print(f"[yellow]Warning: Could not read content for {contract_id}: {str(e)}[/yellow]")
     else:
         # Try to find a .sol file in the contract directory
-        sol_files = [f for f in os.listdir(contract_path) if f.endswith('.sol')]
+        sol_files = glob.glob(os.path.join(glob.escape(contract_path), "*.sol"))
         if sol_files:
             try:
-                with open(os.path.join(contract_path, sol_files[0]), 'r', encoding='utf-8') as f:
+                with open(sol_files[0], 'r', encoding='utf-8') as f:
                     content = f.read()
                 return {
                     "id": contract_id,
@@ -2226,21 +2549,21 @@ def load_contract_content(contract_path):
 def find_existing_partial_reports(session_folder):
     """Find existing partial vulnerability reports in the session folder"""
     reports = []
-    for filename in os.listdir(session_folder):
-        if filename.startswith("vulnerability_report_partial_") and filename.endswith(".md"):
-            report_path = os.path.join(session_folder, filename)
-            # Get the timestamp from the filename
-            timestamp_str = filename.replace("vulnerability_report_partial_", "").replace(".md", "")
-            try:
-                timestamp = datetime.strptime(timestamp_str, "%Y%m%d_%H%M%S") if timestamp_str else None
-                reports.append({
-                    "path": report_path,
-                    "timestamp": timestamp,
-                    "filename": filename
-                })
-            except ValueError:
-                # Skip files with invalid timestamp format
-                pass
+    prefix = "vulnerability_report_partial_"
+    for report_path in glob.glob(os.path.join(glob.escape(session_folder), f"{prefix}*.md")):
+        filename = os.path.basename(report_path)
+        # Get the timestamp from the filename
+        timestamp_str = filename[len(prefix):-len(".md")]
+        try:
+            timestamp = datetime.strptime(timestamp_str, "%Y%m%d_%H%M%S") if timestamp_str else None
+            reports.append({
+                "path": report_path,
+                "timestamp": timestamp,
+                "filename": filename
+            })
+        except ValueError:
+            # Skip files with invalid timestamp format
+            pass
     
     # Sort by timestamp, newest first
     return sorted(reports, key=lambda x: x["timestamp"], reverse=True) if reports else []
@@ -2849,16 +3172,19 @@ def analyze_contract_with_llm_enhanced(contract, vuln_library, existing_findings
     # Format existing findings for the prompt
     existing_findings_text = ""
     if existing_findings:
-        existing_findings_text = "\n## Previous Findings (Requiring Enhancement):\n"
+        findings_lines = ["\n## Previous Findings (Requiring Enhancement):\n"]
         for i, finding in enumerate(existing_findings, 1):
-            existing_findings_text += f"{i}. **{finding.get('vuln_type', 'Unknown Vulnerability')}** - "
-            existing_findings_text += f"Lines: {finding.get('line_numbers', 'Not specified')} - "
-            existing_findings_text += f"Severity: {finding.get('severity', 'Medium')}\n"
             # Add a condensed description to save tokens
             desc = finding.get('description', 'No description')
             if len(desc) > 150:
                 desc = desc[:150] + "..."
-            existing_findings_text += f"   Description: {desc}\n\n"
+            findings_lines.append(
+                f"{i}. **{finding.get('vuln_type', 'Unknown Vulnerability')}** - "
+                f"Lines: {finding.get('line_numbers', 'Not specified')} - "
+                f"Severity: {finding.get('severity', 'Medium')}\n"
+                f"   Description: {desc}\n\n"
+            )
+        existing_findings_text = "".join(findings_lines)
     
     # Build a comprehensive prompt for enhanced vulnerability analysis
     prompt = f"""
@@ -3084,6 +3410,16 @@ def save_qa_session(session_id, session_folder, qa_pairs):
         if conn:
             conn.close()
 
+def format_qa_markdown(session_folder, qa_pairs):
+    """Render a Q&A session as a Markdown document"""
+    parts = [
+        f"# Q&A Session: {os.path.basename(session_folder)}\n\n",
+        f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+    ]
+    for i, qa in enumerate(qa_pairs, 1):
+        parts.append(f"## Question {i}: {qa['question']}\n\n*Asked on: {qa['timestamp']}*\n\n{qa['answer']}\n\n---\n\n")
+    return "".join(parts)
+
 def export_qa_session(session_id, session_folder, qa_pairs, export_format):
     """Export a Q&A session as markdown or PDF"""
     # Create output filename
@@ -3094,14 +3430,7 @@ def export_qa_session(session_id, session_folder, qa_pairs, export_format):
         if export_format == "md":
             # Export as Markdown
             with open(output_path, "w", encoding="utf-8") as f:
-                f.write(f"# Q&A Session: {os.path.basename(session_folder)}\n\n")
-                f.write(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-                
-                for i, qa in enumerate(qa_pairs, 1):
-                    f.write(f"## Question {i}: {qa['question']}\n\n")
-                    f.write(f"*Asked on: {qa['timestamp']}*\n\n")
-                    f.write(f"{qa['answer']}\n\n")
-                    f.write("---\n\n")
+                f.write(format_qa_markdown(session_folder, qa_pairs))
             
             console.print(f"[green]Q&A session exported as Markdown to: {output_path}[/green]")
         
@@ -3113,14 +3442,7 @@ def export_qa_session(session_id, session_folder, qa_pairs, export_format):
                 return
                 
             # First create markdown content
-            md_content = f"# Q&A Session: {os.path.basename(session_folder)}\n\n"
-            md_content += f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-            
-            for i, qa in enumerate(qa_pairs, 1):
-                md_content += f"## Question {i}: {qa['question']}\n\n"
-                md_content += f"*Asked on: {qa['timestamp']}*\n\n"
-                md_content += f"{qa['answer']}\n\n"
-                md_content += "---\n\n"
+            md_content = format_qa_markdown(session_folder, qa_pairs)
             
             # Convert markdown to HTML using Python's markdown library
             html_content = f"""<!DOCTYPE html>
@@ -3164,8 +3486,7 @@ def export_qa_session(session_id, session_folder, qa_pairs, export_format):
 def get_or_create_session():
     """Get an existing session or create a new one"""
     # Look for existing sessions in the current directory
-    sessions = [d for d in os.listdir(os.getcwd()) 
-               if os.path.isdir(os.path.join(os.getcwd(), d)) and d.startswith("analysis_")]
+    sessions = find_session_dirs()
     
     if sessions:
         # Sort sessions by creation time (newest first)
@@ -3239,21 +3560,13 @@ def get_contracts_in_session(session_folder):
     contracts_dir = os.path.join(session_folder, "contracts")
     if os.path.isdir(contracts_dir):
         # Look for .sol files directly in the contracts directory
-        contracts = []
-        for item in os.listdir(contracts_dir):
-            if item.endswith(".sol"):
-                contracts.append(os.path.join(contracts_dir, item))
+        with os.scandir(contracts_dir) as entries:
+            contracts = [entry.path for entry in entries if entry.name.endswith(".sol")]
         if contracts:
             return contracts
     
     # Fallback: look for contract directories (those with a .sol extension)
-    contracts = []
-    for item in os.listdir(session_folder):
-        item_path = os.path.join(session_folder, item)
-        if os.path.isdir(item_path) and item.endswith(".sol"):
-            contracts.append(item_path)
-    
-    return contracts
+    return find_analysis_dirs(session_folder)
 
 def get_documents_in_session(session_folder):
     """Get all document folders in a session"""
@@ -3261,13 +3574,7 @@ def get_documents_in_session(session_folder):
         return []
     
     # Look for document directories (those not ending with .sol)
-    documents = []
-    for item in os.listdir(session_folder):
-        item_path = os.path.join(session_folder, item)
-        if os.path.isdir(item_path) and not item.endswith(".sol"):
-            documents.append(item_path)
-    
-    return documents
+    return find_analysis_dirs(session_folder, contracts=False)
 
 # -------------------------------
 # Contract Analysis Functions
@@ -3348,18 +3655,22 @@ def parse_analysis_sections(analysis_text):
     # Simple parsing logic - can be enhanced for better section detection
     if "vulnerability" in analysis_text.lower() or "security" in analysis_text.lower():
         parts = analysis_text.split("\n\n")
+        grouped = {name: [] for name in sections}
         
         for part in parts:
             lower_part = part.lower()
             if "overview" in lower_part or "purpose" in lower_part or "functionality" in lower_part:
-                sections["overview"] += part + "\n\n"
+                grouped["overview"].append(part)
             elif "vulnerability" in lower_part or "security issue" in lower_part or "risk" in lower_part:
-                sections["vulnerabilities"] += part + "\n\n"
+                grouped["vulnerabilities"].append(part)
             elif "recommendation" in lower_part or "best practice" in lower_part or "improvement" in lower_part:
-                sections["recommendations"] += part + "\n\n"
+                grouped["recommendations"].append(part)
             else:
                 # Add to overview if not matched to another section
-                sections["overview"] += part + "\n\n"
+                grouped["overview"].append(part)
+        
+        for name, section_parts in grouped.items():
+            sections[name] = "".join(part + "\n\n" for part in section_parts)
     else:
         # If no clear sections, just use the entire text as the overview
         sections["overview"] = analysis_text
@@ -3383,9 +3694,9 @@ def contract_menu(contract_path):
             contract_file_path = main_file
         else:
             # Try to find any .sol file in the directory
-            sol_files = [f for f in os.listdir(contract_path) if f.endswith('.sol')]
+            sol_files = glob.glob(os.path.join(glob.escape(contract_path), "*.sol"))
             if sol_files:
-                contract_file_path = os.path.join(contract_path, sol_files[0])
+                contract_file_path = sol_files[0]
             else:
                 console.print("[bold red]Could not find contract file in directory.[/bold red]")
                 return
@@ -3408,11 +3719,13 @@ def contract_menu(contract_path):
     diagrams = []
     reports = []
     if contract_folder:
-        for item in os.listdir(contract_folder):
-            if item.endswith('.md') and ('diagram' in item or 'chart' in item or 'flow' in item):
-                diagrams.append(os.path.join(contract_folder, item))
-            elif item.endswith('.md') and ('report' in item or 'analysis' in item or 'functions' in item):
-                reports.append(os.path.join(contract_folder, item))
+        # Computed once per menu; only Markdown artefacts are candidates
+        for path in glob.glob(os.path.join(glob.escape(contract_folder), "*.md")):
+            item = os.path.basename(path)
+            if 'diagram' in item or 'chart' in item or 'flow' in item:
+                diagrams.append(path)
+            elif 'report' in item or 'analysis' in item or 'functions' in item:
+                reports.append(path)
     
     while True:
         console.print("\n[bold]Contract Actions:[/bold]")
@@ -3512,8 +3825,7 @@ def contract_menu(contract_path):
                     diagram_choice = int(Prompt.ask("Enter diagram number (0 to cancel)"))
                     if 1 <= diagram_choice <= len(diagrams):
                         selected_diagram = diagrams[diagram_choice - 1]
-                        with open(selected_diagram, 'r', encoding='utf-8') as f:
-                            diagram_content = f.read()
+                        diagram_content = read_file(selected_diagram) or ""
                         
                         console.print(f"\n[bold]Diagram:[/bold] {os.path.basename(selected_diagram)}")
                         console.print(Markdown(diagram_content))
@@ -3533,8 +3845,7 @@ def contract_menu(contract_path):
                     report_choice = int(Prompt.ask("Enter report number (0 to cancel)"))
                     if 1 <= report_choice <= len(reports):
                         selected_report = reports[report_choice - 1]
-                        with open(selected_report, 'r', encoding='utf-8') as f:
-                            report_content = f.read()
+                        report_content = read_file(selected_report) or ""
                         
                         console.print(f"\n[bold]Report:[/bold] {os.path.basename(selected_report)}")
                         console.print(Markdown(report_content))
@@ -3606,14 +3917,18 @@ def documents_menu_in_session(session_folder):
 # -------------------------------
 # Process a Single Contract
 # -------------------------------
-async def process_contract_async(filepath, output_dir, progress=None):
-    """Process a smart contract file and generate analysis"""
+async def process_contract_async(filepath, output_dir, progress=None, pending_rows=None):
+    """Process a smart contract file and generate analysis
+
+    If pending_rows is given, the database row is queued on it instead of written immediately.
+    """
     # Extract contract id and name
     contract_id = hashlib.md5(filepath.encode()).hexdigest()
     contract_name = os.path.basename(filepath)
     
-    # Read contract content
-    contract_content = read_contract_file(filepath)
+    # Read contract content off the event loop
+    loop = asyncio.get_running_loop()
+    contract_content, content_sha = await loop.run_in_executor(None, read_contract_file, filepath)
     if not contract_content:
         console.print(f"[bold red]Failed to read contract: {filepath}[/bold red]")
         return
@@ -3622,45 +3937,73 @@ async def process_contract_async(filepath, output_dir, progress=None):
     contract_dir = os.path.join(output_dir, contract_name)
     os.makedirs(contract_dir, exist_ok=True)
     
-    # Save the original contract file
-    contract_path = save_file(contract_content, "original.sol", contract_dir)
+    # Copy the original contract file in the background while the LLM phases run
+    original_saved = loop.run_in_executor(None, copy_file, filepath, "original.sol", contract_dir)
     
     # Create a dictionary to store all generated reports
     reports = {}
     
+    # Identical source (e.g. a vendored library) analysed before by this model: reuse it
+    previous = load_analysis_by_content(content_sha, ANALYSIS_MODEL) if REUSE_ANALYSES else None
+    if previous:
+        reports.update(previous)
+        await asyncio.gather(
+            original_saved,
+            *[save_file_async(report, f"{name}.md", contract_dir) for name, report in reports.items()]
+        )
+        save_analysis(
+            contract_id, contract_name, contract_content,
+            previous["functions_report"], previous["journey_report"],
+            previous["journey_diagram"], previous["call_diagram"],
+            content_sha, ANALYSIS_MODEL, pending=pending_rows
+        )
+        console.print(f"[bold green]Reused earlier analysis of identical source for {contract_name}.[/bold green] Results saved to {contract_dir}")
+        return reports
+    
+    # Track which models answer the phases, so the row records the model that produced it
+    models_used = set()
+    llm_models_used.set(models_used)
+    
     # Progress indicator for each phase
     task_id = None
     if progress:
-        task_id = progress.add_task(f"Analyzing {contract_name} - Functions", total=1)
-    
-    # Phase 1: Generate Functions Report
-    functions_report = generate_functions_report(contract_content)
-    functions_path = save_file(functions_report, "functions_report.md", contract_dir)
-    reports["functions_report"] = functions_report
-    
-    if progress and task_id is not None:
-        progress.update(task_id, description=f"Analyzing {contract_name} - Journey")
-    
-    # Phase 2: Generate Journey Report
-    journey_report = generate_journey_report(contract_content)
-    journey_path = save_file(journey_report, "journey_report.md", contract_dir)
-    reports["journey_report"] = journey_report
-    
-    if progress and task_id is not None:
-        progress.update(task_id, description=f"Analyzing {contract_name} - Journey Diagram")
-    
-    # Phase 3a: Generate Journey Diagram
-    journey_diagram = generate_journey_diagram(journey_report)
-    journey_diagram_path = save_file(journey_diagram, "journey_diagram.md", contract_dir)
-    reports["journey_diagram"] = journey_diagram
-    
-    if progress and task_id is not None:
-        progress.update(task_id, description=f"Analyzing {contract_name} - Call Diagram")
+        task_id = progress.add_task(f"Analyzing {contract_name} - Functions & Journey", total=1)
+    
+    # Phases 1 and 2 only need the contract, and each diagram only needs its own report,
+    # so run the two report -> diagram chains side by side instead of four calls in a row
+    async def functions_chain():
+        # Phase 1: Generate Functions Report
+        functions_report = await generate_functions_report(contract_content)
+        await save_file_async(functions_report, "functions_report.md", contract_dir)
+        reports["functions_report"] = functions_report
+        
+        if progress and task_id is not None:
+            progress.update(task_id, description=f"Analyzing {contract_name} - Call Diagram")
+        
+        # Phase 3b: Generate Call Diagram
+        call_diagram = await generate_call_diagram(functions_report)
+        await save_file_async(call_diagram, "call_diagram.md", contract_dir)
+        reports["call_diagram"] = call_diagram
+    
+    async def journey_chain():
+        # Phase 2: Generate Journey Report
+        journey_report = await generate_journey_report(contract_content)
+        await save_file_async(journey_report, "journey_report.md", contract_dir)
+        reports["journey_report"] = journey_report
+        
+        if progress and task_id is not None:
+            progress.update(task_id, description=f"Analyzing {contract_name} - Journey Diagram")
+        
+        # Phase 3a: Generate Journey Diagram
+        journey_diagram = await generate_journey_diagram(journey_report)
+        await save_file_async(journey_diagram, "journey_diagram.md", contract_dir)
+        reports["journey_diagram"] = journey_diagram
     
-    # Phase 3b: Generate Call Diagram
-    call_diagram = generate_call_diagram(functions_report)
-    call_diagram_path = save_file(call_diagram, "call_diagram.md", contract_dir)
-    reports["call_diagram"] = call_diagram
+    await asyncio.gather(functions_chain(), journey_chain(), original_saved)
+    functions_report = reports["functions_report"]
+    journey_report = reports["journey_report"]
+    journey_diagram = reports["journey_diagram"]
+    call_diagram = reports["call_diagram"]
     
     # Complete the task
     if progress and task_id is not None:
@@ -3669,7 +4012,9 @@ async def process_contract_async(filepath, output_dir, progress=None):
     # Save all reports to database
     save_analysis(
         contract_id, contract_name, contract_content,
-        functions_report, journey_report, journey_diagram, call_diagram
+        functions_report, journey_report, journey_diagram, call_diagram,
+        # Only a single answering model makes the row reusable for that model
+        content_sha, next(iter(models_used)) if len(models_used) == 1 else None, pending=pending_rows
     )
     
     console.print(f"[bold green]Contract analysis complete![/bold green] Results saved to {contract_dir}")
@@ -3683,20 +4028,37 @@ def process_contract(filepath, output_dir):
         TextColumn("[progress.description]{task.description}"),
         console=console
     ) as progress:
-        asyncio.run(process_contract_async(filepath, output_dir, progress))
+        async def _run():
+            try:
+                return await process_contract_async(filepath, output_dir, progress)
+            finally:
+                await close_async_session()
+        asyncio.run(_run())
 
 # -------------------------------
 # Batch Processing Functions
 # -------------------------------
-async def process_contracts_parallel(contract_files, output_folder, max_workers=3):
-    """Process multiple contracts in parallel"""
+async def process_contracts_parallel(contract_files, output_folder, max_workers=None):
+    """Process multiple contracts in parallel, at most max_workers at a time"""
+    semaphore = asyncio.Semaphore(max(1, max_workers or LLM_CONCURRENCY))
+    # Database rows are written together once the directory is done, in one transaction
+    pending_rows = []
+    
+    async def _guarded(filepath):
+        async with semaphore:
+            return await process_contract_async(filepath, output_folder, progress, pending_rows)
+    
     with Progress(
         SpinnerColumn(),
         TextColumn("[bold blue]Processing contracts... {task.description}"),
         console=console
     ) as progress:
-        tasks = [process_contract_async(filepath, output_folder, progress) for filepath in contract_files]
-        await asyncio.gather(*tasks)
+        try:
+            await asyncio.gather(*[_guarded(filepath) for filepath in contract_files])
+        finally:
+            # The HTTP sessions belong to this event loop; close them before asyncio.run returns
+            await close_async_session()
+            save_analyses(pending_rows)
 
 async def process_documents_parallel(document_paths, output_folder, source_types=None, max_workers=3):
     """Process multiple documents in parallel"""
@@ -3722,7 +4084,7 @@ def test_ollama_connection():
     """Test the connection to the Ollama API and print available models using ollama-python"""
     try:
         # Use the ollama-python client to list models
-        response = ollama.list()
+        response = ollama_clients[0].list()
         
         # Extract models - ollama-python uses Pydantic models, not dictionaries
         models = []
@@ -3794,8 +4156,8 @@ def call_openrouter_sync(prompt, model=None):
         model = "deepseek/deepseek-v3-base:free"  # Default OpenRouter model
 
     # Check cache first
-    cache_key = hashlib.sha256((prompt + model + "openrouter_sync").encode()).hexdigest()
-    cached_response = cache.get(cache_key)
+    cache_key = llm_cache_key(prompt, model, "openrouter_sync")
+    cached_response = get_cached_response(cache_key)
     if cached_response:
         return cached_response
 
@@ -3803,13 +4165,7 @@ def call_openrouter_sync(prompt, model=None):
     messages = [{"role": "user", "content": prompt}]
 
     # Add required headers including HTTP_REFERER and X-Title for data policy - exactly as in docs
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "https://github.com/pxng0lin/DeepCurrent",  # Required for data policies
-        "X-Title": "DeepCurrent Smart Contract Analyzer",  # Required for data policies
-        "X-Data-Usage": OPENROUTER_DATA_USAGE  # Control data usage policy
-    }
+    headers = openrouter_headers(OPENROUTER_API_KEY, OPENROUTER_DATA_USAGE)
     
     # Simplified payload
     payload = {
@@ -3831,10 +4187,10 @@ def call_openrouter_sync(prompt, model=None):
         
         try:
             console.print(f"[cyan]Calling OpenRouter with model: {current_model} (non-streaming)[/cyan]")
-            response = requests.post(OPENROUTER_API_URL, json=payload, headers=headers)
+            response = http_session.post(OPENROUTER_API_URL, data=json_dumps_bytes(payload), headers=headers, timeout=(10, 600))
             
             if response.status_code == 200:
-                response_data = response.json()
+                response_data = json_loads(response.content)
                 if 'choices' in response_data and response_data['choices'] and 'message' in response_data['choices'][0]:
                     message = response_data['choices'][0]['message']
                     content = message.get('content', '')
@@ -3868,14 +4224,8 @@ def test_openrouter_connection(api_key):
     """Test the connection to OpenRouter and verify the API key and return only free models"""
     try:
         # Include required headers for data policy compliance
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://github.com/pxng0lin/DeepCurrent",  # Required for data policies
-            "X-Title": "DeepCurrent Smart Contract Analyzer",  # Required for data policies
-            "X-Data-Usage": OPENROUTER_DATA_USAGE  # Control data usage policy
-        }
-        response = requests.get("https://openrouter.ai/api/v1/models", headers=headers)
+        headers = openrouter_headers(api_key, OPENROUTER_DATA_USAGE)
+        response = http_session.get("https://openrouter.ai/api/v1/models", headers=headers)
         if response.status_code == 200:
             all_models = response.json().get("data", [])
             
@@ -3916,17 +4266,23 @@ def test_openrouter_connection(api_key):
 # -------------------------------
 def main():
     init_db()
-    update_db_schema()
-    global ANALYSIS_MODEL, QUERY_MODEL, LLM_PROVIDER, OPENROUTER_API_KEY, OPENROUTER_DATA_USAGE
+    global ANALYSIS_MODEL, QUERY_MODEL, LLM_PROVIDER, OPENROUTER_API_KEY, OPENROUTER_DATA_USAGE, USE_LLM_CACHE, REUSE_ANALYSES
     
     # Set up the argument parser
     parser = argparse.ArgumentParser(description="DeepCurrent Protocol and Smart Contract Analysis Tool")
     parser.add_argument("--data-usage", choices=["enable", "null", "disabled"], default="null",
                       help="OpenRouter data usage policy: enable, null, or disabled")
+    parser.add_argument("--no-cache", action="store_true",
+                      help="Ignore cached LLM responses and request fresh ones")
+    parser.add_argument("--force", action="store_true",
+                      help="Re-analyse contracts even if identical source was analysed before")
     args = parser.parse_args()
     
     # Set data usage policy from command line
     OPENROUTER_DATA_USAGE = args.data_usage
+    USE_LLM_CACHE = not args.no_cache
+    if args.force:
+        REUSE_ANALYSES = False
     
     # Choose LLM provider with a numbered menu
     console.print("Choose LLM provider:")
@@ -4003,8 +4359,7 @@ def main():
                 output_folder = get_or_create_session()
                 
                 # Process all .sol files in the directory
-                contract_files = [os.path.join(directory, f) for f in os.listdir(directory)
-                                if os.path.isfile(os.path.join(directory, f)) and f.endswith(".sol")]
+                contract_files = find_contract_files(directory)
                 if not contract_files:
                     console.print("No smart contract files (.sol) found in the directory.")
                     continue
@@ -4037,8 +4392,7 @@ def main():
                             console.print("The provided directory does not exist.")
                         else:
                             # Process contract files
-                            contract_files = [os.path.join(directory, f) for f in os.listdir(directory)
-                                            if os.path.isfile(os.path.join(directory, f)) and f.endswith(".sol")]
+                            contract_files = find_contract_files(directory)
                             if not contract_files:
                                 console.print("No smart contract files (.sol) found in the directory.")
                             else:
@@ -4065,6 +4419,7 @@ def main():
         # Clean up
         asyncio.run(close_async_session())
         cache.close()
+        close_db()
 
 if __name__ == "__main__":
     main()